@@ -24,30 +24,182 @@ except:
 
     # Support Python 2
 
+try:
+    from socketserver import ThreadingMixIn  # type: ignore
+    from xmlrpc.client import Error as XmlRpcError  # type: ignore
+    from xmlrpc.client import ServerProxy  # type: ignore
+    from xmlrpc.server import SimpleXMLRPCRequestHandler  # type: ignore
+except ImportError:
+    from SocketServer import ThreadingMixIn  # type: ignore
+    from xmlrpclib import Error as XmlRpcError  # type: ignore
+    from xmlrpclib import ServerProxy  # type: ignore
+    from SimpleXMLRPCServer import SimpleXMLRPCRequestHandler  # type: ignore
+
+import heapq
+import io
+import random
+import re
+import socket
+import sys
 import threading
 import time
-from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
 
 from robot.api import logger
 from robot.libraries.BuiltIn import BuiltIn
 from robot.libraries.Remote import Remote
 from robot.running import TestLibrary
 
-from .robotremoteserver import RobotRemoteServer
+# Robot's Remote opens a new connection for every call and has no option for
+# passing a transport, so reusing connections relies on its internal client.
+# The keep-alive client is only used when that client looks as expected.
+try:
+    from robot.libraries.Remote import (
+        TimeoutHTTPSTransport,
+        TimeoutHTTPTransport,
+        XmlRpcRemoteClient,
+    )
+
+    _KEEP_ALIVE_CLIENT_SUPPORTED = isinstance(
+        vars(XmlRpcRemoteClient).get("_server"), property
+    )
+except ImportError:
+    _KEEP_ALIVE_CLIENT_SUPPORTED = False
+
+from .robotremoteserver import RobotRemoteServer, StoppableXMLRPCServer
 
 PABOT_LAST_LEVEL = "PABOTLASTLEVEL"
 PABOT_QUEUE_INDEX = "PABOTQUEUEINDEX"
 PABOT_LAST_EXECUTION_IN_POOL = "PABOTISLASTEXECUTIONINPOOL"
 PABOT_MIN_QUEUE_INDEX_EXECUTING_PARALLEL_VALUE = "pabot_min_queue_index_executing"
 
+_VAR_LAST_LEVEL = "${%s}" % PABOT_LAST_LEVEL
+_VAR_QUEUE_INDEX = "${%s}" % PABOT_QUEUE_INDEX
+_VAR_LAST_EXECUTION_IN_POOL = "${%s}" % PABOT_LAST_EXECUTION_IN_POOL
+
+_SECTION_RE = re.compile(r"^\[([^\]]+)\]\s*$")
+_KV_RE = re.compile(r"^([^=:\s][^=:]*)\s*[:=]\s*(.*)$")
+
+_MAX_BACKOFF_SECONDS = 0.5
+
+
+def _backoff_sleep(attempt, polling_seconds, sleep=time.sleep):
+    # type: (int, float, Callable[[float], None]) -> None
+    # Backs off exponentially from the polling interval so that long waits
+    # poll less often. The jitter keeps parallel processes that poll the same
+    # lock or value from retrying in lockstep, but never waits less than the
+    # polling interval.
+    cap = max(polling_seconds, _MAX_BACKOFF_SECONDS)
+    delay = min(cap, polling_seconds * 2 ** min(attempt, 16))
+    sleep(random.uniform(max(polling_seconds, delay / 2), delay))
+
+
+class _FreeValueSets(object):
+    """Free value set names ordered by their position in the resourcefile.
+
+    Removed names stay in the heap until they reach its front, so adding and
+    removing a name does not need to search the heap.
+    """
+
+    def __init__(self):
+        self._heap = []  # type: List[Tuple[int, str]]
+        self._queued = {}  # type: Dict[str, int]
+        self._free = set()  # type: Set[str]
+
+    def __len__(self):
+        return len(self._free)
+
+    def add(self, position, setname):  # type: (int, str) -> None
+        self._free.add(setname)
+        if self._queued.get(setname) != position:
+            self._queued[setname] = position
+            heapq.heappush(self._heap, (position, setname))
+
+    def remove(self, setname):  # type: (str) -> None
+        self._free.discard(setname)
+
+    def first(self, accept):  # type: (Callable[[str], bool]) -> Optional[str]
+        skipped = []
+        found = None
+        while self._heap:
+            position, setname = self._heap[0]
+            if self._queued.get(setname) != position:
+                heapq.heappop(self._heap)
+            elif setname not in self._free:
+                heapq.heappop(self._heap)
+                del self._queued[setname]
+            elif accept(setname):
+                found = setname
+                break
+            else:
+                skipped.append(heapq.heappop(self._heap))
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+        return found
+
+
+class _ResourceFileSyntaxError(Exception):
+    pass
+
+
+def _read_resourcefile(resourcefile):
+    # type: (str) -> Dict[str, Dict[str, str]]
+    # Fast path for the plain "[section]" + "key = value" format.
+    # Anything configparser would treat specially (continuation lines,
+    # interpolation, DEFAULT section, duplicates) is left to configparser.
+    vals = {}  # type: Dict[str, Dict[str, str]]
+    section = None  # type: Optional[Dict[str, str]]
+    with io.open(resourcefile, "r", encoding="utf-8") as f:
+        for line in f:
+            if line[:1].isspace() and line.strip():
+                raise _ResourceFileSyntaxError("continuation line")
+            line = line.strip()
+            if not line or line[0] in "#;":
+                continue
+            match = _SECTION_RE.match(line)
+            if match:
+                name = match.group(1)
+                if name in vals or name == configparser.DEFAULTSECT:
+                    raise _ResourceFileSyntaxError("section %s" % name)
+                section = vals[name] = {}
+                continue
+            match = _KV_RE.match(line)
+            if section is None or not match:
+                raise _ResourceFileSyntaxError(line)
+            key, value = match.group(1).strip().lower(), match.group(2)
+            if key in section or "%" in value:
+                raise _ResourceFileSyntaxError(line)
+            section[key] = value
+    return vals
+
+
+def _read_resourcefile_with_configparser(resourcefile):
+    # type: (str) -> Dict[str, Dict[str, str]]
+    conf = configparser.ConfigParser()
+    conf.read(resourcefile)
+    return dict((section, dict(conf.items(section))) for section in conf.sections())
+
+
+def _split_tags(tags):  # type: (Optional[str]) -> List[str]
+    if not tags:
+        return []
+    # Tags are compared on every value set acquisition, interning them makes
+    # those comparisons identity checks.
+    return [sys.intern(t) for t in (t.strip() for t in tags.split(",")) if t]
+
 
 class _PabotLib(object):
 
     _TAGS_KEY = "tags"
 
     def __init__(self, resourcefile=None):  # type: (Optional[str]) -> None
+        # Keywords may be called from several server threads at once.
+        self._state_lock = threading.RLock()
         self._locks = {}  # type: Dict[str, Tuple[str, int]]
+        self._locks_by_caller = {}  # type: Dict[str, Set[str]]
         self._owner_to_values = {}  # type: Dict[str, Dict[str, object]]
+        self._owned_setname_by_caller = {}  # type: Dict[str, str]
         self._parallel_values = {}  # type: Dict[str, object]
         self._remote_libraries = (
             {}
@@ -56,103 +208,179 @@ class _PabotLib(object):
         self._added_suites = []  # type: List[Tuple[str, List[str]]]
         self._ignored_executions = set()  # type: Set[str]
 
+    @property
+    def _values(self):  # type: () -> Dict[str, Dict[str, Any]]
+        return self.__values
+
+    @_values.setter
+    def _values(self, values):  # type: (Dict[str, Dict[str, Any]]) -> None
+        self.__values = values
+        # Sets are reserved in resourcefile order, like the ordered dict scan.
+        self._free_sets_by_tag = {}  # type: Dict[str, _FreeValueSets]
+        self._free_sets = _FreeValueSets()
+        self._set_positions = {}  # type: Dict[str, int]
+        self._next_set_position = 0
+        for setname in values:
+            self._index_value_set(setname)
+        for setname in self._owned_setname_by_caller.values():
+            if setname in values:
+                self._mark_value_set_owned(setname)
+
+    def _index_value_set(self, setname):  # type: (str) -> None
+        if setname not in self._set_positions:
+            self._set_positions[setname] = self._next_set_position
+            self._next_set_position += 1
+        for tag in self.__values[setname][self._TAGS_KEY]:
+            if tag not in self._free_sets_by_tag:
+                self._free_sets_by_tag[tag] = _FreeValueSets()
+        self._mark_value_set_free(setname)
+
+    def _unindex_value_set(self, setname):  # type: (str) -> None
+        self._mark_value_set_owned(setname)
+
+    def _mark_value_set_owned(self, setname):  # type: (str) -> None
+        for tag in self.__values[setname][self._TAGS_KEY]:
+            self._free_sets_by_tag[tag].remove(setname)
+        self._free_sets.remove(setname)
+
+    def _mark_value_set_free(self, setname):  # type: (str) -> None
+        position = self._set_positions[setname]
+        for tag in self.__values[setname][self._TAGS_KEY]:
+            self._free_sets_by_tag[tag].add(position, setname)
+        self._free_sets.add(position, setname)
+
     def _parse_values(
         self, resourcefile
     ):  # type: (Optional[str]) -> Dict[str, Dict[str, Any]]
-        vals = {}  # type: Dict[str, Dict[str, Any]]
         if resourcefile is None:
-            return vals
-        conf = configparser.ConfigParser()
-        conf.read(resourcefile)
-        for section in conf.sections():
-            vals[section] = dict(
-                (k, conf.get(section, k)) for k in conf.options(section)
-            )
-        for section in vals:
-            if self._TAGS_KEY in vals[section]:
-                vals[section][self._TAGS_KEY] = [
-                    t.strip() for t in vals[section][self._TAGS_KEY].split(",")
-                ]
-            else:
-                vals[section][self._TAGS_KEY] = []
+            return {}
+        try:
+            vals = _read_resourcefile(
+                resourcefile
+            )  # type: Dict[str, Dict[str, Any]]
+        except (_ResourceFileSyntaxError, UnicodeDecodeError, IOError):
+            vals = _read_resourcefile_with_configparser(resourcefile)
+        for values in vals.values():
+            values[self._TAGS_KEY] = _split_tags(values.get(self._TAGS_KEY))
         return vals
 
     def set_parallel_value_for_key(self, key, value):  # type: (str, object) -> None
-        self._parallel_values[key] = value
+        with self._state_lock:
+            self._parallel_values[key] = value
 
     def get_parallel_value_for_key(self, key):  # type: (str) -> object
-        return self._parallel_values.get(key, "")
+        with self._state_lock:
+            return self._parallel_values.get(key, "")
 
     def acquire_lock(self, name, caller_id):  # type: (str, str) -> bool
-        if name in self._locks and caller_id != self._locks[name][0]:
-            return False
-        if name not in self._locks:
-            self._locks[name] = (caller_id, 0)
-        self._locks[name] = (caller_id, self._locks[name][1] + 1)
-        return True
+        with self._state_lock:
+            entry = self._locks.get(name)
+            if entry is None:
+                self._locks[name] = (caller_id, 1)
+                self._locks_by_caller.setdefault(caller_id, set()).add(name)
+                return True
+            if entry[0] != caller_id:
+                return False
+            self._locks[name] = (caller_id, entry[1] + 1)
+            return True
 
     def release_lock(self, name, caller_id):  # type: (str, str) -> None
-        assert self._locks[name][0] == caller_id
-        self._locks[name] = (caller_id, self._locks[name][1] - 1)
-        if self._locks[name][1] == 0:
-            del self._locks[name]
+        with self._state_lock:
+            entry = self._locks[name]
+            assert entry[0] == caller_id
+            if entry[1] > 1:
+                self._locks[name] = (caller_id, entry[1] - 1)
+            else:
+                del self._locks[name]
+                owned = self._locks_by_caller[caller_id]
+                owned.discard(name)
+                if not owned:
+                    del self._locks_by_caller[caller_id]
 
     def release_locks(self, caller_id):
         # type: (str) -> None
-        for key in list(self._locks.keys()):
-            if self._locks[key][0] == caller_id:
-                self._locks[key] = (caller_id, self._locks[key][1] - 1)
-                if self._locks[key][1] == 0:
-                    del self._locks[key]
+        with self._state_lock:
+            for key in self._locks_by_caller.pop(caller_id, ()):
+                del self._locks[key]
 
     def acquire_value_set(self, caller_id, *tags):
-        if not self._values:
-            raise AssertionError(
-                "Value set cannot be aquired. It was never imported or all are disabled. Use --resourcefile option to import."
-            )
-        # CAN ONLY RESERVE ONE VALUE SET AT A TIME
-        if (
-            caller_id in self._owner_to_values
-            and self._owner_to_values[caller_id] is not None
-        ):
-            raise ValueError("Caller has already reserved a value set.")
-        matching = False
-        for valueset_key in self._values:
-            if all(tag in self._values[valueset_key][self._TAGS_KEY] for tag in tags):
-                matching = True
-                if self._values[valueset_key] not in self._owner_to_values.values():
-                    self._owner_to_values[caller_id] = self._values[valueset_key]
-                    return (valueset_key, self._values[valueset_key])
-        if not matching:
-            raise ValueError("No value set matching given tags exists.")
-        # This return value is for situations where no set could be reserved
-        # and the caller needs to wait until one is free.
-        return (None, None)
+        with self._state_lock:
+            if not self._values:
+                raise AssertionError(
+                    "Value set cannot be aquired. It was never imported or all are disabled. Use --resourcefile option to import."
+                )
+            # CAN ONLY RESERVE ONE VALUE SET AT A TIME
+            if self._owner_to_values.get(caller_id) is not None:
+                raise ValueError("Caller has already reserved a value set.")
+            if tags:
+                valueset_key = self._first_free_set_with_tags(tags)
+            else:
+                valueset_key = self._free_sets.first(lambda setname: True)
+            if valueset_key is None:
+                # No free set matches, so a matching set can only be reserved.
+                if tags and not any(
+                    self._has_tags(setname, tags)
+                    for setname in self._owned_setname_by_caller.values()
+                ):
+                    raise ValueError("No value set matching given tags exists.")
+                # This return value is for situations where no set could be reserved
+                # and the caller needs to wait until one is free.
+                return (None, None)
+            self._mark_value_set_owned(valueset_key)
+            self._owned_setname_by_caller[caller_id] = valueset_key
+            self._owner_to_values[caller_id] = self._values[valueset_key]
+            return (valueset_key, self._values[valueset_key])
+
+    def _first_free_set_with_tags(self, tags):
+        # type: (Tuple[str, ...]) -> Optional[str]
+        if not all(tag in self._free_sets_by_tag for tag in tags):
+            return None
+        # The first free set of the rarest tag that has the other tags too.
+        free_sets = min((self._free_sets_by_tag[tag] for tag in tags), key=len)
+        return free_sets.first(lambda setname: self._has_tags(setname, tags))
+
+    def _has_tags(self, setname, tags):  # type: (str, Tuple[str, ...]) -> bool
+        if setname not in self.__values:
+            return False
+        set_tags = self.__values[setname][self._TAGS_KEY]
+        return all(tag in set_tags for tag in tags)
 
     def release_value_set(self, caller_id):  # type: (str) -> None
-        if caller_id not in self._owner_to_values:
-            return
-        del self._owner_to_values[caller_id]
+        with self._state_lock:
+            if self._owner_to_values.pop(caller_id, None) is None:
+                return
+            setname = self._owned_setname_by_caller.pop(caller_id, None)
+            if setname is not None and setname in self._values:
+                self._mark_value_set_free(setname)
 
     def disable_value_set(self, setname, caller_id):  # type: (str, str) -> None
-        del self._owner_to_values[caller_id]
-        del self._values[setname]
+        with self._state_lock:
+            # The reserved set is known here, setname is kept for older clients.
+            setname = self._owned_setname_by_caller.pop(caller_id, setname)
+            del self._owner_to_values[caller_id]
+            self._unindex_value_set(setname)
+            del self._set_positions[setname]
+            del self._values[setname]
 
     def get_value_from_set(self, key, caller_id):  # type: (str, str) -> object
-        if caller_id not in self._owner_to_values:
-            raise AssertionError("No value set reserved for caller process")
-        if key not in self._owner_to_values[caller_id]:
-            raise AssertionError('No value for key "%s"' % key)
-        return self._owner_to_values[caller_id][key]
+        with self._state_lock:
+            if caller_id not in self._owner_to_values:
+                raise AssertionError("No value set reserved for caller process")
+            if key not in self._owner_to_values[caller_id]:
+                raise AssertionError('No value for key "%s"' % key)
+            return self._owner_to_values[caller_id][key]
 
     def add_value_to_set(self, name, content):
-        if self._TAGS_KEY in content.keys():
-            content[self._TAGS_KEY] = [
-                t.strip() for t in content[self._TAGS_KEY].split(",")
-            ]
-        if self._TAGS_KEY not in content.keys():
-            content[self._TAGS_KEY] = []
-        self._values[name] = content
+        # Keys are stored lower-cased like the ones read from a resourcefile.
+        content = dict((k.lower(), v) for k, v in content.items())
+        content[self._TAGS_KEY] = _split_tags(content.get(self._TAGS_KEY))
+        with self._state_lock:
+            if name in self._values:
+                self._unindex_value_set(name)
+            self._values[name] = content
+            self._index_value_set(name)
+            if name in self._owned_setname_by_caller.values():
+                self._mark_value_set_owned(name)
 
     def import_shared_library(self, name, args=None):  # type: (str, Iterable[Any]|None) -> int
         if name in self._remote_libraries:
@@ -161,10 +389,10 @@ class _PabotLib(object):
         server = RobotRemoteServer(
             imported.get_instance(), port=0, serve=False, allow_stop=True
         )
+        # Binding before the thread starts makes the port known right away.
+        port = server.activate()
         server_thread = threading.Thread(target=server.serve)
         server_thread.start()
-        time.sleep(1)
-        port = server.server_port
         self._remote_libraries[name] = (port, server, server_thread)
         return port
 
@@ -191,6 +419,100 @@ class _PabotLib(object):
             self._remote_libraries[name][2].join()
 
 
+class _ServedPabotLib(_PabotLib):
+    """_PabotLib served by the PabotLib server process.
+
+    Keywords that only remote PabotLib clients call live here, so that they
+    are not exposed as keywords of the PabotLib library itself.
+    """
+
+    def acquire_lock_and_get_value(
+        self, name, caller_id, value_key
+    ):  # type: (str, str, str) -> Tuple[bool, object]
+        with self._state_lock:
+            if not self.acquire_lock(name, caller_id):
+                return (False, "")
+            return (True, self.get_parallel_value_for_key(value_key))
+
+    def release_lock_and_set_value(
+        self, name, caller_id, value_key, value
+    ):  # type: (str, str, str, object) -> None
+        with self._state_lock:
+            self.set_parallel_value_for_key(value_key, value)
+            self.release_lock(name, caller_id)
+
+
+class _KeepAliveRequestHandler(SimpleXMLRPCRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Idle connections are closed after this many seconds, clients reconnect.
+    timeout = 60
+
+    def log_error(self, format, *args):
+        # Idle connections timing out is expected, e.g. during long tests.
+        if not format.startswith("Request timed out"):
+            SimpleXMLRPCRequestHandler.log_error(self, format, *args)
+
+
+class _PabotLibXMLRPCServer(ThreadingMixIn, StoppableXMLRPCServer):
+    """XML-RPC server that keeps client connections open between calls.
+
+    Each connection gets its own thread but keywords are still run one at a
+    time, because running a keyword swaps the global sys.stdout and sys.stderr.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host, port):
+        StoppableXMLRPCServer.__init__(self, host, port)
+        self.RequestHandlerClass = _KeepAliveRequestHandler
+        self._dispatch_lock = threading.Lock()
+
+    def _dispatch(self, method, params):
+        with self._dispatch_lock:
+            return StoppableXMLRPCServer._dispatch(self, method, params)
+
+
+class _PabotLibRemoteServer(RobotRemoteServer):
+    def _create_server(self, host, port):
+        return _PabotLibXMLRPCServer(host, port)
+
+
+if _KEEP_ALIVE_CLIENT_SUPPORTED:
+
+    class _KeepAliveRemoteClient(XmlRpcRemoteClient):
+        """XML-RPC client that reuses one connection for all calls."""
+
+        def __init__(self, uri, timeout=None):
+            XmlRpcRemoteClient.__init__(self, uri, timeout)
+            self._proxy = None
+
+        @property  # type: ignore
+        @contextmanager
+        def _server(self):
+            if self._proxy is None:
+                if self.uri.startswith("https://"):
+                    transport = TimeoutHTTPSTransport(timeout=self.timeout)
+                else:
+                    transport = TimeoutHTTPTransport(timeout=self.timeout)
+                self._proxy = ServerProxy(
+                    self.uri, encoding="UTF-8", transport=transport
+                )
+            try:
+                yield self._proxy
+            except (socket.error, XmlRpcError) as err:
+                self._proxy("close")()
+                self._proxy = None
+                raise TypeError(err)
+
+
+def _keep_alive_remote(uri):  # type: (str) -> Remote
+    remote = Remote(uri)
+    client = getattr(remote, "_client", None)
+    if _KEEP_ALIVE_CLIENT_SUPPORTED and type(client) is XmlRpcRemoteClient:
+        remote._client = _KeepAliveRemoteClient(client.uri, client.timeout)
+    return remote
+
+
 class PabotLib(_PabotLib):
 
     __version__ = 0.67
@@ -204,24 +526,30 @@ class PabotLib(_PabotLib):
     def __init__(self):
         _PabotLib.__init__(self)
         self.__remotelib = None
+        self.__remote_run_keyword = None
+        self.__remote_keywords = None  # type: Optional[Set[str]]
         self.__my_id = None
+        self.__pabot_variables = {}  # type: Dict[str, Any]
+        # Final PASSED/FAILED results of run once keywords, they never change.
+        self._run_once_results = {}  # type: Dict[str, object]
         self._valueset = None
         self._setname = None
         self.ROBOT_LIBRARY_LISTENER = self
         self._position = []  # type: List[str]
         self._row_index = 0
+        self._row_stack = []  # type: List[int]
 
     def _start(self, name, attributes):
         self._position.append(attributes["longname"])
 
     def _end(self, name, attributes):
-        self._position = (
-            self._position[:-1]
-            if len(self._position) > 1
-            else [attributes["longname"][: -len(name) - 1]]
-        )
+        if len(self._position) > 1:
+            self._position.pop()
+        else:
+            self._position = [attributes["longname"][: -len(name) - 1]]
 
     def _start_keyword(self, name, attributes):
+        self._row_stack.append(self._row_index)
         if not (self._position):
             self._position = ["0", "0." + str(self._row_index)]
         else:
@@ -233,19 +561,24 @@ class PabotLib(_PabotLib):
             self._row_index = 1
             self._position = ["0"]
             return
+        if self._row_stack and len(self._position) > 1:
+            self._row_index = self._row_stack.pop() + 1
+            self._position.pop()
+            return
+        # Keyword ended without a start event, e.g. dynamic Import Library.
         splitted = self._position[-1].split(".")
         self._row_index = int(splitted[-1]) if len(splitted) > 1 else 0
         self._row_index += 1
-        self._position = (
-            self._position[:-1]
-            if len(self._position) > 1
-            else [str(int(splitted[0]) + 1)]
-        )
+        if len(self._position) > 1:
+            self._position.pop()
+        else:
+            self._position = [str(int(splitted[0]) + 1)]
 
     _start_suite = _start_test = _start
     _end_suite = _end_test = _end
 
     def _close(self):
+        self.__pabot_variables = {}
         try:
             self.release_locks()
             self.release_value_set()
@@ -274,23 +607,48 @@ class PabotLib(_PabotLib):
             self.__my_id = my_id if my_id else None
         return self.__my_id
 
+    def _pabot_variable(self, variable):  # type: (str) -> Any
+        # Pabot passes these as command line variables, so they stay the same
+        # for the whole execution of this process.
+        if variable not in self.__pabot_variables:
+            self.__pabot_variables[variable] = BuiltIn().get_variable_value(variable)
+        return self.__pabot_variables[variable]
+
+    @property
+    def _pabot_last_level(self):  # type: () -> Optional[str]
+        return self._pabot_variable(_VAR_LAST_LEVEL)
+
+    @property
+    def _pabot_queue_index(self):  # type: () -> int
+        return int(self._pabot_variable(_VAR_QUEUE_INDEX) or 0)
+
+    @property
+    def _pabot_last_in_pool(self):  # type: () -> bool
+        return int(self._pabot_variable(_VAR_LAST_EXECUTION_IN_POOL) or 1) == 1
+
     @property
     def _remotelib(self):
         if self.__remotelib is None:
             uri = BuiltIn().get_variable_value("${PABOTLIBURI}")
             logger.debug("PabotLib URI %r" % uri)
-            self.__remotelib = Remote(uri) if uri else None
+            if uri:
+                self.__remotelib = _keep_alive_remote(uri)
+                self.__remote_run_keyword = self.__remotelib.run_keyword
+            else:
+                self.__remotelib = None
         return self.__remotelib
 
     def set_polling_seconds(self, secs):
         """
         Determine the amount of seconds to wait between checking for free locks. Default: 0.1  (100ms)
+        The wait grows on every check while a lock stays taken, up to 0.5 seconds or the given value if it is longer.
         """
         PabotLib._pollingSeconds = secs
 
     def set_polling_seconds_setupteardown(self, secs):
         """
         Determine the amount of seconds to wait between checking for free locks during setup and teardown. Default: 0.3  (300ms)
+        The wait grows on every check, up to 0.5 seconds or the given value if it is longer.
         """
         PabotLib._pollingSeconds_SetupTeardown = secs
 
@@ -311,21 +669,19 @@ class PabotLib(_PabotLib):
         if self._execution_ignored:
             return
         lock_name = "pabot_setup_%s" % self._path
+        passed = self._run_once_status(lock_name)
+        if passed != "":
+            if passed == "FAILED":
+                raise AssertionError("Setup failed in other process")
+            logger.info("Setup skipped in this item")
+            return
+        status = "FAILED"
         try:
-            self.acquire_lock(lock_name)
-            passed = self.get_parallel_value_for_key(lock_name)
-            if passed != "":
-                if passed == "FAILED":
-                    raise AssertionError("Setup failed in other process")
-                logger.info("Setup skipped in this item")
-                return
             BuiltIn().run_keyword(keyword, *args)
-            self.set_parallel_value_for_key(lock_name, "PASSED")
-        except:
-            self.set_parallel_value_for_key(lock_name, "FAILED")
-            raise
+            status = "PASSED"
         finally:
-            self.release_lock(lock_name)
+            self._release_lock_and_set_value(lock_name, lock_name, status)
+            self._run_once_results[lock_name] = status
 
     def run_only_once(self, keyword, *args):
         """
@@ -338,21 +694,30 @@ class PabotLib(_PabotLib):
         if self._execution_ignored:
             return
         lock_name = "pabot_run_only_once_%s_%s" % (keyword, str(args))
+        passed = self._run_once_status(lock_name)
+        if passed != "":
+            if passed == "FAILED":
+                raise AssertionError("Keyword failed in other process")
+            logger.info("Skipped in this item")
+            return
+        status = "FAILED"
         try:
-            self.acquire_lock(lock_name)
-            passed = self.get_parallel_value_for_key(lock_name)
-            if passed != "":
-                if passed == "FAILED":
-                    raise AssertionError("Keyword failed in other process")
-                logger.info("Skipped in this item")
-                return
             BuiltIn().run_keyword(keyword, *args)
-            self.set_parallel_value_for_key(lock_name, "PASSED")
-        except:
-            self.set_parallel_value_for_key(lock_name, "FAILED")
-            raise
+            status = "PASSED"
         finally:
+            self._release_lock_and_set_value(lock_name, lock_name, status)
+            self._run_once_results[lock_name] = status
+
+    def _run_once_status(self, lock_name):  # type: (str) -> object
+        # Returns the earlier result or "" with the lock held by this caller.
+        if lock_name in self._run_once_results:
+            return self._run_once_results[lock_name]
+        passed = self._acquire_lock_and_get_value(lock_name, lock_name)
+        if passed != "":
             self.release_lock(lock_name)
+            if passed in ("PASSED", "FAILED"):
+                self._run_once_results[lock_name] = passed
+        return passed
 
     def run_teardown_only_once(self, keyword, *args):
         """
@@ -361,7 +726,7 @@ class PabotLib(_PabotLib):
         """
         if self._execution_ignored:
             return
-        last_level = BuiltIn().get_variable_value("${%s}" % PABOT_LAST_LEVEL)
+        last_level = self._pabot_last_level
         if last_level is None:
             BuiltIn().run_keyword(keyword, *args)
             return
@@ -369,11 +734,10 @@ class PabotLib(_PabotLib):
         if not self._path.startswith(last_level):
             logger.info("Teardown skipped in this item")
             return
-        queue_index = int(
-            BuiltIn().get_variable_value("${%s}" % PABOT_QUEUE_INDEX) or 0
-        )
+        queue_index = self._pabot_queue_index
         logger.trace("Queue index (%d)" % queue_index)
         if self._remotelib:
+            attempt = 0
             while (
                 self.get_parallel_value_for_key(
                     PABOT_MIN_QUEUE_INDEX_EXECUTING_PARALLEL_VALUE
@@ -386,7 +750,8 @@ class PabotLib(_PabotLib):
                             PABOT_MIN_QUEUE_INDEX_EXECUTING_PARALLEL_VALUE
                         )
                     )
-                time.sleep(PabotLib._pollingSeconds_SetupTeardown)
+                _backoff_sleep(attempt, PabotLib._pollingSeconds_SetupTeardown)
+                attempt += 1
         logger.trace("Teardown conditions met. Executing keyword.")
         BuiltIn().run_keyword(keyword, *args)
 
@@ -397,22 +762,15 @@ class PabotLib(_PabotLib):
         """
         if self._execution_ignored:
             return
-        is_last = (
-            int(
-                BuiltIn().get_variable_value("${%s}" % PABOT_LAST_EXECUTION_IN_POOL)
-                or 1
-            )
-            == 1
-        )
-        if not is_last:
+        if not self._pabot_last_in_pool:
             logger.info("Skipped in this item")
             return
-        queue_index = int(
-            BuiltIn().get_variable_value("${%s}" % PABOT_QUEUE_INDEX) or 0
-        )
+        queue_index = self._pabot_queue_index
         if queue_index > 0 and self._remotelib:
+            attempt = 0
             while self.get_parallel_value_for_key("pabot_only_last_executing") != 1:
-                time.sleep(PabotLib._pollingSeconds_SetupTeardown)
+                _backoff_sleep(attempt, PabotLib._pollingSeconds_SetupTeardown)
+                attempt += 1
         BuiltIn().run_keyword(keyword)
 
     def set_parallel_value_for_key(self, key, value):
@@ -421,22 +779,27 @@ class PabotLib(_PabotLib):
         from all the pabot processes.
         [https://pabot.org/PabotLib.html?ref=log#set-parallel-value-for-key|Open online docs.]
         """
+        self._run_once_results.pop(key, None)
         self._run_with_lib("set_parallel_value_for_key", key, value)
 
     def _run_with_lib(self, keyword, *args):
         if self._remotelib:
             try:
-                return self._remotelib.run_keyword(keyword, args, {})
+                return self.__remote_run_keyword(keyword, args, {})
             except RuntimeError as err:
-                logger.error(
-                    "RuntimeError catched in remotelib keyword execution. Maybe there is no connection - is pabot called with --pabotlib option? ErrorDetails: {0}".format(
-                        repr(err)
-                    )
-                )
-                self.__remotelib = None
+                self._remote_failed("remotelib keyword", err)
                 raise
         return getattr(_PabotLib, keyword)(self, *args)
 
+    def _remote_failed(self, execution, err):  # type: (str, RuntimeError) -> None
+        logger.error(
+            "RuntimeError catched in {0} execution. Maybe there is no connection - is pabot called with --pabotlib option? ErrorDetails: {1}".format(
+                execution, repr(err)
+            )
+        )
+        self.__remotelib = None
+        self.__remote_keywords = None
+
     def add_suite_to_execution_queue(self, suitename, *variables):
         self._run_with_lib("add_suite_to_execution_queue", suitename, variables)
 
@@ -454,23 +817,61 @@ class PabotLib(_PabotLib):
         [https://pabot.org/PabotLib.html?ref=log#acquire-lock|Open online docs.]
         """
         if self._remotelib:
+            self._poll_remote(
+                "acquire_lock", [name, self._my_id], bool, "waiting for lock to release"
+            )
+            return True
+        return _PabotLib.acquire_lock(self, name, self._my_id)
+
+    def _poll_remote(self, keyword, args, is_done, waiting_message):
+        # Runs a remote keyword until is_done accepts its result.
+        try:
+            attempt = 0
+            while True:
+                result = self.__remote_run_keyword(keyword, args, {})
+                if is_done(result):
+                    return result
+                _backoff_sleep(attempt, PabotLib._pollingSeconds)
+                attempt += 1
+                if PabotLib._polling_logging:
+                    logger.debug(waiting_message)
+        except RuntimeError as err:
+            self._remote_failed("remote " + keyword, err)
+            raise
+
+    def _remote_has_keyword(self, name):  # type: (str) -> bool
+        # Older PabotLib servers do not provide the combined keywords.
+        if self.__remote_keywords is None:
             try:
-                while not self._remotelib.run_keyword(
-                    "acquire_lock", [name, self._my_id], {}
-                ):
-                    time.sleep(PabotLib._pollingSeconds)
-                    if PabotLib._polling_logging:
-                        logger.debug("waiting for lock to release")
-                return True
+                self.__remote_keywords = set(self._remotelib.get_keyword_names())
             except RuntimeError as err:
-                logger.error(
-                    "RuntimeError catched in remote acquire_lock execution. Maybe there is no connection - is pabot called with --pabotlib option? ErrorDetails: {0}".format(
-                        repr(err)
-                    )
-                )
-                self.__remotelib = None
+                self._remote_failed("remote get_keyword_names", err)
                 raise
-        return _PabotLib.acquire_lock(self, name, self._my_id)
+        return name in self.__remote_keywords
+
+    def _acquire_lock_and_get_value(self, name, value_key):
+        if not (
+            self._remotelib and self._remote_has_keyword("acquire_lock_and_get_value")
+        ):
+            self.acquire_lock(name)
+            return self.get_parallel_value_for_key(value_key)
+        return self._poll_remote(
+            "acquire_lock_and_get_value",
+            [name, self._my_id, value_key],
+            lambda result: result[0],
+            "waiting for lock to release",
+        )[1]
+
+    def _release_lock_and_set_value(self, name, value_key, value):
+        if not (
+            self._remotelib and self._remote_has_keyword("release_lock_and_set_value")
+        ):
+            self.set_parallel_value_for_key(value_key, value)
+            self.release_lock(name)
+            return
+        self._run_with_lib(
+            "release_lock_and_set_value", name, self._my_id, value_key, value
+        )
 
     def release_lock(self, name):
         """
@@ -498,25 +899,14 @@ class PabotLib(_PabotLib):
 
     def _acquire_value_set(self, *tags):
         if self._remotelib:
-            try:
-                while True:
-                    self._setname, self._valueset = self._remotelib.run_keyword(
-                        "acquire_value_set", [self._my_id] + list(tags), {}
-                    )
-                    if self._setname:
-                        logger.info('Value set "%s" acquired' % self._setname)
-                        return self._setname
-                    time.sleep(PabotLib._pollingSeconds)
-                    if PabotLib._polling_logging:
-                        logger.debug("waiting for a value set")
-            except RuntimeError as err:
-                logger.error(
-                    "RuntimeError catched in remote _acquire_value_set execution. Maybe there is no connection - is pabot called with --pabotlib option? ErrorDetails: {0}".format(
-                        repr(err)
-                    )
-                )
-                self.__remotelib = None
-                raise
+            self._setname, self._valueset = self._poll_remote(
+                "acquire_value_set",
+                [self._my_id] + list(tags),
+                lambda result: result[0],
+                "waiting for a value set",
+            )
+            logger.info('Value set "%s" acquired' % self._setname)
+            return self._setname
         self._setname, self._valueset = _PabotLib.acquire_value_set(
             self, self._my_id, *tags
         )
@@ -566,8 +956,9 @@ class PabotLib(_PabotLib):
 pabotlib = PabotLib
 
 if __name__ == "__main__":
-    import sys
-
-    RobotRemoteServer(
-        _PabotLib(sys.argv[1]), host=sys.argv[2], port=sys.argv[3], allow_stop=True
+    _PabotLibRemoteServer(
+        _ServedPabotLib(sys.argv[1]),
+        host=sys.argv[2],
+        port=sys.argv[3],
+        allow_stop=True,
     )
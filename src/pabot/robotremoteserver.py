@@ -83,7 +83,7 @@ class RobotRemoteServer(object):
                             ``stop_remote_server`` XML-RPC method.
         """
         self._library = RemoteLibraryFactory(library)
-        self._server = StoppableXMLRPCServer(host, int(port))
+        self._server = self._create_server(host, int(port))
         self._register_functions(self._server)
         self._port_file = port_file
         self._allow_remote_stop = (
@@ -92,6 +92,9 @@ class RobotRemoteServer(object):
         if serve:
             self.serve()
 
+    def _create_server(self, host, port):
+        return StoppableXMLRPCServer(host, port)
+
     def _register_functions(self, server):
         server.register_function(self.get_keyword_names)
         server.register_function(self.run_keyword)
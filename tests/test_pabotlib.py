@@ -1,5 +1,13 @@
 import unittest
+import contextlib
+import io
 import os
+import shutil
+import socket
+import tempfile
+import textwrap
+import threading
+import time
 
 from robot.errors import RobotError
 
@@ -42,6 +50,25 @@ class PabotLibTests(unittest.TestCase):
         self.assertEqual(lib._path, "")
         lib._close()
 
+    def test_pabotlib_listener_path_with_nested_keywords(self):
+        lib = pabotlib.PabotLib()
+        lib._start_suite("Suite", {"longname": "Suite"})
+        lib._start_test("Test", {"longname": "Suite.Test"})
+        lib._start_keyword("Keyword1", {})
+        lib._start_keyword("Inner1", {})
+        self.assertEqual(lib._path, "Suite.Test.0.0")
+        lib._end_keyword("Inner1", {})
+        lib._start_keyword("Inner2", {})
+        self.assertEqual(lib._path, "Suite.Test.0.1")
+        lib._end_keyword("Inner2", {})
+        lib._end_keyword("Keyword1", {})
+        self.assertEqual(lib._path, "Suite.Test")
+        lib._start_keyword("Keyword2", {})
+        self.assertEqual(lib._path, "Suite.Test.1")
+        lib._end_keyword("Keyword2", {})
+        lib._end_test("Test", {"longname": "Suite.Test"})
+        self.assertEqual(lib._path, "Suite")
+
     def test_pabotlib_listener_when_dynamic_import_with_import_library(self):
         lib = pabotlib.PabotLib()
         lib._end_keyword("Import Library", {})
@@ -121,6 +148,100 @@ class PabotLibTests(unittest.TestCase):
         lib.run_only_once("keyword")
         self.assertEqual(self._runs, 1)
 
+    def test_pabotlib_run_setup_only_once_failure_is_shared(self):
+        lib = pabotlib.PabotLib()
+
+        def failing(*args):
+            raise AssertionError("setup failed")
+
+        self.builtinmock.run_keyword = failing
+        self.assertRaises(AssertionError, lib.run_setup_only_once, "keyword")
+        self.assertEqual(lib._locks, {})
+        self.builtinmock.run_keyword = lambda *args: self.fail("Should not run")
+        self.assertRaises(AssertionError, lib.run_setup_only_once, "keyword")
+        self.assertEqual(lib._locks, {})
+
+    def _remote_lib(self, server, keyword_names):
+        calls = []
+        remote = lambda: 0
+        remote.get_keyword_names = lambda: keyword_names
+
+        def run_keyword(name, args, kwargs):
+            calls.append(name)
+            return getattr(server, name)(*args)
+
+        remote.run_keyword = run_keyword
+        lib = pabotlib.PabotLib()
+        lib._PabotLib__remotelib = remote
+        lib._PabotLib__remote_run_keyword = run_keyword
+        return lib, calls
+
+    def test_pabotlib_run_only_once_uses_combined_remote_keywords(self):
+        server = pabotlib._ServedPabotLib()
+        lib, calls = self._remote_lib(
+            server, ["acquire_lock_and_get_value", "release_lock_and_set_value"]
+        )
+        lib.run_only_once("keyword")
+        self.assertEqual(self._runs, 1)
+        self.assertEqual(
+            calls, ["acquire_lock_and_get_value", "release_lock_and_set_value"]
+        )
+        self.assertEqual(server._locks, {})
+        self.assertEqual(
+            server.get_parallel_value_for_key("pabot_run_only_once_keyword_()"),
+            "PASSED",
+        )
+        self.assertFalse(hasattr(lib, "acquire_lock_and_get_value"))
+        self.assertFalse(hasattr(lib, "release_lock_and_set_value"))
+
+    def test_pabotlib_run_only_once_result_is_cached(self):
+        server = pabotlib._ServedPabotLib()
+        lib, calls = self._remote_lib(
+            server, ["acquire_lock_and_get_value", "release_lock_and_set_value"]
+        )
+        lib.run_only_once("keyword")
+        del calls[:]
+        lib.run_only_once("keyword")
+        self.assertEqual(self._runs, 1)
+        self.assertEqual(calls, [])
+        other, calls = self._remote_lib(
+            server, ["acquire_lock_and_get_value", "release_lock_and_set_value"]
+        )
+        other.run_only_once("keyword")
+        other.run_only_once("keyword")
+        self.assertEqual(self._runs, 1)
+        self.assertEqual(calls, ["acquire_lock_and_get_value", "release_lock"])
+
+    def test_pabotlib_run_only_once_with_old_remote_server(self):
+        server = pabotlib._PabotLib()
+        lib, calls = self._remote_lib(server, ["acquire_lock"])
+        lib.run_only_once("keyword")
+        lib.run_only_once("keyword")
+        self.assertEqual(self._runs, 1)
+        self.assertNotIn("acquire_lock_and_get_value", calls)
+        self.assertNotIn("release_lock_and_set_value", calls)
+        self.assertEqual(server._locks, {})
+
+    def test_pabotlib_run_only_once_when_remote_keyword_names_fail(self):
+        lib, calls = self._remote_lib(pabotlib._ServedPabotLib(), [])
+
+        def connection_failed():
+            raise RuntimeError("Connecting remote server failed")
+
+        lib._PabotLib__remotelib.get_keyword_names = connection_failed
+        errors = []
+        logger = pabotlib.logger
+        pabotlib.logger = lambda: 0
+        pabotlib.logger.error = errors.append
+        try:
+            self.assertRaises(RuntimeError, lib.run_only_once, "keyword")
+        finally:
+            pabotlib.logger = logger
+        self.assertEqual(self._runs, 0)
+        self.assertEqual(len(errors), 1)
+        self.assertIn("is pabot called with --pabotlib option?", errors[0])
+        self.assertIsNone(lib._PabotLib__remotelib)
+
     def test_pabotlib_run_on_last_process(self):
         lib = pabotlib.PabotLib()
         self.assertEqual(self._runs, 0)
@@ -128,10 +249,31 @@ class PabotLibTests(unittest.TestCase):
         lib.run_on_last_process("keyword")
         self.assertEqual(self._runs, 0)
         self.builtinmock.get_variable_value = lambda *args: "1"
+        lib = pabotlib.PabotLib()
         lib.get_parallel_value_for_key = lambda *args: 1
         lib.run_on_last_process("keyword")
         self.assertEqual(self._runs, 1)
 
+    def test_pabot_variables_are_read_once_per_process(self):
+        reads = []
+
+        def get_variable_value(name):
+            if name in ("${CALLER_ID}", "${PABOTLIBURI}"):
+                return None
+            reads.append(name)
+            return "3"
+
+        self.builtinmock.get_variable_value = get_variable_value
+        lib = pabotlib.PabotLib()
+        self.assertEqual(lib._pabot_queue_index, 3)
+        self.assertEqual(lib._pabot_queue_index, 3)
+        self.assertEqual(lib._pabot_last_level, "3")
+        self.assertFalse(lib._pabot_last_in_pool)
+        self.assertEqual(len(reads), 3)
+        lib._close()
+        self.assertEqual(lib._pabot_queue_index, 3)
+        self.assertEqual(len(reads), 4)
+
     def test_pabotlib_run_on_last_process_defaults_to_running(self):
         lib = pabotlib.PabotLib()
         self.assertEqual(self._runs, 0)
@@ -157,6 +299,81 @@ class PabotLibTests(unittest.TestCase):
         self.assertTrue("somelock" not in lib._locks)
         self.assertTrue("somelock2" not in lib._locks)
 
+    def test_releasing_reacquired_lock_on_close(self):
+        lib = pabotlib.PabotLib()
+        self.assertTrue(lib.acquire_lock("somelock"))
+        self.assertTrue(lib.acquire_lock("somelock"))
+        lib._close()
+        self.assertTrue("somelock" not in lib._locks)
+
+    def test_backoff_sleep_grows_from_polling_seconds(self):
+        sleeps = []
+        for attempt in range(2000):
+            pabotlib._backoff_sleep(attempt, 0.1, sleep=sleeps.append)
+        self.assertEqual(sleeps[0], 0.1)
+        self.assertTrue(all(0.1 <= s <= 0.5 for s in sleeps))
+        self.assertTrue(all(0.25 <= s for s in sleeps[3:]))
+        sleeps = []
+        for attempt in range(10):
+            pabotlib._backoff_sleep(attempt, 2, sleep=sleeps.append)
+        self.assertEqual(sleeps, [2] * 10)
+
+    def test_backoff_polls_less_than_fixed_interval_during_long_wait(self):
+        sleeps = []
+        while sum(sleeps) < 3:
+            pabotlib._backoff_sleep(len(sleeps), 0.1, sleeps.append)
+        # Polling every 0.1 seconds would take 30 polls.
+        self.assertLess(len(sleeps), 15)
+
+    def test_reacquired_lock_is_held_until_released_as_many_times(self):
+        lib = pabotlib._PabotLib()
+        self.assertTrue(lib.acquire_lock("lock", "caller1"))
+        self.assertTrue(lib.acquire_lock("lock", "caller1"))
+        self.assertEqual(lib._locks["lock"], ("caller1", 2))
+        lib.release_lock("lock", "caller1")
+        self.assertFalse(lib.acquire_lock("lock", "caller2"))
+        lib.release_lock("lock", "caller1")
+        self.assertTrue(lib.acquire_lock("lock", "caller2"))
+
+    def test_release_locks_only_releases_callers_locks(self):
+        lib = pabotlib._PabotLib()
+        self.assertTrue(lib.acquire_lock("first", "caller1"))
+        self.assertTrue(lib.acquire_lock("second", "caller1"))
+        self.assertTrue(lib.acquire_lock("third", "caller2"))
+        lib.release_lock("second", "caller1")
+        lib.release_locks("caller1")
+        self.assertEqual(list(lib._locks), ["third"])
+        self.assertEqual(lib._locks_by_caller, {"caller2": set(["third"])})
+        self.assertTrue(lib.acquire_lock("first", "caller2"))
+
+    def test_lock_is_acquired_by_one_of_concurrent_callers(self):
+        lib = pabotlib._PabotLib()
+
+        class SlowDict(dict):
+            # Gives the other thread time to run between lookup and update.
+            def get(self, *args):
+                value = dict.get(self, *args)
+                time.sleep(0.05)
+                return value
+
+        lib._locks = SlowDict()
+        acquired = []
+        threads = [
+            threading.Thread(
+                target=lambda caller_id: acquired.append(
+                    lib.acquire_lock("shared", caller_id)
+                ),
+                args=("caller%d" % i,),
+            )
+            for i in range(2)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(acquired), [False, True])
+        self.assertEqual(len(lib._locks_by_caller), 1)
+
     def test_acquire_and_release_valueset(self):
         lib = pabotlib.PabotLib()
         lib._values = lib._parse_values(
@@ -210,6 +427,74 @@ class PabotLibTests(unittest.TestCase):
         self.assertEquals("someVal2", lib.get_value_from_set("key"))
         lib.release_value_set()
 
+    def test_add_to_valueset_skips_empty_tags(self):
+        lib = pabotlib.PabotLib()
+        lib.add_value_to_set("WithTags", {"key": "a", "tags": " one, ,two,"})
+        lib.add_value_to_set("EmptyTags", {"key": "b", "tags": ""})
+        self.assertEqual(lib._values["WithTags"]["tags"], ["one", "two"])
+        self.assertEqual(lib._values["EmptyTags"]["tags"], [])
+
+    def test_import_shared_library_returns_bound_port(self):
+        lib = pabotlib._PabotLib()
+        port = lib.import_shared_library("String")
+        try:
+            self.assertNotEqual(port, 0)
+            self.assertEqual(lib.import_shared_library("String"), port)
+            remote = pabotlib.Remote("127.0.0.1:%d" % port)
+            self.assertEqual(
+                remote.run_keyword("convert_to_upper_case", ["abc"], {}), "ABC"
+            )
+        finally:
+            lib.stop_remote_libraries()
+
+    def test_add_to_valueset_keys_are_case_insensitive(self):
+        lib = pabotlib.PabotLib()
+        lib.add_value_to_set("MixedCase", {"MyKey": "value", "Tags": "mixed"})
+        self.assertEqual(lib.acquire_value_set("mixed"), "MixedCase")
+        self.assertEqual(lib.get_value_from_set("mykey"), "value")
+        self.assertEqual(lib.get_value_from_set("MYKEY"), "value")
+        lib.release_value_set()
+
+    def test_pabotlib_server_keeps_connections_alive(self):
+        server = pabotlib._PabotLibRemoteServer(
+            pabotlib._PabotLib(), port=0, serve=False, allow_stop=True
+        )
+        port = server.activate()
+        connections = []
+        get_request = server._server.get_request
+
+        def counting_get_request():
+            connections.append(get_request())
+            return connections[-1]
+
+        server._server.get_request = counting_get_request
+        server_thread = threading.Thread(target=server.serve, args=(False,))
+        server_thread.start()
+        try:
+            uri = "127.0.0.1:%d" % port
+            first = pabotlib._keep_alive_remote(uri)
+            second = pabotlib._keep_alive_remote(uri)
+            self.assertTrue(first.run_keyword("acquire_lock", ["lock", "1"], {}))
+            self.assertFalse(second.run_keyword("acquire_lock", ["lock", "2"], {}))
+            first.run_keyword("release_lock", ["lock", "1"], {})
+            self.assertTrue(second.run_keyword("acquire_lock", ["lock", "2"], {}))
+            self.assertEqual(len(connections), 2)
+        finally:
+            server.stop()
+            server_thread.join()
+
+    def test_pabotlib_server_does_not_log_idle_connection_timeouts(self):
+        handler = pabotlib._KeepAliveRequestHandler.__new__(
+            pabotlib._KeepAliveRequestHandler
+        )
+        handler.client_address = ("127.0.0.1", 0)
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            handler.log_error("Request timed out: %r", socket.timeout("timed out"))
+            self.assertEqual(stderr.getvalue(), "")
+            handler.log_error("code %d, message %s", 400, "Bad request")
+        self.assertIn("Bad request", stderr.getvalue())
+
     def test_ignore_execution_will_not_run_special_keywords_after(self):
         lib = pabotlib.PabotLib()
         try:
@@ -254,6 +539,40 @@ class PabotLibTests(unittest.TestCase):
         lib.release_value_set()
         self.assertEqual(value, "true")
 
+    def test_acquire_valueset_from_large_resourcefile_is_fast(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            resourcefile = os.path.join(tmpdir, "large.dat")
+            with open(resourcefile, "w") as f:
+                for i in range(10000):
+                    f.write("[Set%d]\ntags = shared\nkey = %d\n\n" % (i, i))
+            lib = pabotlib._PabotLib(resourcefile)
+        finally:
+            shutil.rmtree(tmpdir)
+        for i in range(64):
+            setname = lib.acquire_value_set("owner%d" % i, "shared")[0]
+            self.assertEqual(setname, "Set%d" % i)
+        start = time.time()
+        for tags in [("shared",)] * 1000 + [()] * 1000:
+            self.assertEqual(lib.acquire_value_set("caller", *tags)[0], "Set64")
+            lib.release_value_set("caller")
+        self.assertLess(time.time() - start, 1.0)
+
+    def test_valuesets_are_acquired_in_resourcefile_order(self):
+        lib = pabotlib._PabotLib(os.path.join("tests", "resourcefile.dat"))
+        self.assertEqual(lib.acquire_value_set("c1")[0], "MyValueSet")
+        self.assertEqual(lib.acquire_value_set("c2")[0], "TestSystemWithLasers")
+        self.assertEqual(
+            lib.acquire_value_set("c3", "commontag")[0], "TestSystemWithTachyonCannon"
+        )
+        lib.release_value_set("c2")
+        lib.add_value_to_set("TestSystemWithLasers", {"tags": "commontag"})
+        lib.add_value_to_set("Added", {"tags": "commontag"})
+        self.assertEqual(
+            lib.acquire_value_set("c4", "commontag")[0], "TestSystemWithLasers"
+        )
+        self.assertEqual(lib.acquire_value_set("c5")[0], "Added")
+
     def test_reacquire_valueset(self):
         lib = pabotlib.PabotLib()
         lib._values = lib._parse_values(
@@ -268,6 +587,31 @@ class PabotLibTests(unittest.TestCase):
         finally:
             lib.release_value_set()
 
+    def test_valueset_is_free_again_only_after_release(self):
+        lib = pabotlib._PabotLib(os.path.join("tests", "resourcefile.dat"))
+        first, _ = lib.acquire_value_set("caller1", "commontag")
+        second, _ = lib.acquire_value_set("caller2", "commontag")
+        self.assertEqual(
+            set([first, second]),
+            set(["TestSystemWithLasers", "TestSystemWithTachyonCannon"]),
+        )
+        self.assertEqual(lib.acquire_value_set("caller3", "commontag"), (None, None))
+        lib.release_value_set("caller1")
+        self.assertEqual(lib.acquire_value_set("caller3", "commontag")[0], first)
+        lib.disable_value_set(None, "caller2")
+        lib.release_value_set("caller3")
+        self.assertEqual(lib.acquire_value_set("caller2", "commontag")[0], first)
+        self.assertEqual(lib.acquire_value_set("caller3", "commontag"), (None, None))
+
+    def test_released_valuesets_leave_no_owner_entries(self):
+        lib = pabotlib._PabotLib(os.path.join("tests", "resourcefile.dat"))
+        for i in range(10):
+            lib.acquire_value_set("caller%d" % i)
+            lib.release_value_set("caller%d" % i)
+        lib.release_value_set("never-acquired")
+        self.assertEqual(lib._owner_to_values, {})
+        self.assertEqual(lib._owned_setname_by_caller, {})
+
     def test_trying_to_acquire_valueset_with_none_existing_tag(self):
         lib = pabotlib.PabotLib()
         lib._values = lib._parse_values(
@@ -279,6 +623,42 @@ class PabotLibTests(unittest.TestCase):
         except ValueError:
             pass
 
+    def test_fast_resourcefile_parser_matches_configparser(self):
+        for name in ("resourcefile.dat", "valueset.dat"):
+            resourcefile = os.path.join("tests", name)
+            self.assertEqual(
+                pabotlib._read_resourcefile(resourcefile),
+                pabotlib._read_resourcefile_with_configparser(resourcefile),
+            )
+
+    def test_resourcefile_parser_falls_back_to_configparser(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            resourcefile = os.path.join(tmpdir, "interpolated.dat")
+            with open(resourcefile, "w") as f:
+                f.write(
+                    textwrap.dedent(
+                        """
+                        [Set]
+                        host = example.com
+                        url = http://%(host)s/
+                        multi = first
+                          second
+                        """
+                    )
+                )
+            self.assertRaises(
+                pabotlib._ResourceFileSyntaxError,
+                pabotlib._read_resourcefile,
+                resourcefile,
+            )
+            values = pabotlib._PabotLib(resourcefile)._values
+            self.assertEqual(values["Set"]["url"], "http://example.com/")
+            self.assertEqual(values["Set"]["multi"], "first\nsecond")
+            self.assertEqual(values["Set"]["tags"], [])
+        finally:
+            shutil.rmtree(tmpdir)
+
     def _output(self):
         output = lambda: 0
         output.start_keyword = output.end_keyword = lambda *a: 0